@@ -1,11 +1,14 @@
 import argparse
+import functools
 import importlib
 import logging
 import os
 import subprocess
 import sys
 import textwrap
+import weakref
 
+from concurrent.futures import ThreadPoolExecutor
 from importlib import util as importlib_util
 
 from . import __version__
@@ -20,6 +23,17 @@ HEADER = "# This is an autogenerated file. Do not edit this file directly."
 IDENTATION = "  "
 
 
+class _Newlines(dict):
+    """Maps a nesting depth to a newline followed by its indentation."""
+
+    def __missing__(self, depth: int) -> str:
+        newline = self[depth] = "\n" + IDENTATION * depth
+        return newline
+
+
+_NEWLINES = _Newlines()
+
+
 class Attribute(str):
     """An `Attribute` handles access to not yet known attributes.
     This called by `Block.__getattr__` to deal with
@@ -39,12 +53,32 @@ class Attribute(str):
     """
 
     def __getattr__(self, name):
-        return Attribute(f'{self}.{name}')
+        if name.startswith("__"):
+            raise AttributeError(name)
+        # Keep the child on this reference, so accessing it again is a plain
+        # attribute hit that does not come back here.
+        child = _attribute(str.__add__(self, '.' + name))
+        setattr(self, name, child)
+        return child
+
+
+# Live `Attribute` objects by path, so that repeated references to the same
+# attribute share one object instead of each building its own copy.
+_ATTRIBUTES = weakref.WeakValueDictionary()
+
+
+def _attribute(path: str) -> Attribute:
+    attribute = _ATTRIBUTES.get(path)
+    if attribute is None:
+        attribute = _ATTRIBUTES[path] = Attribute(path)
+    return attribute
 
 
 class Block(dict):
     """ A `Block` is a dictionary-like container for other content. """
 
+    __slots__ = ()
+
     # def __init__(self, **kwargs):
     #     # Convert variables into references instead of adding the actual dict.
     #     for k, v in kwargs.items():
@@ -55,12 +89,10 @@ class Block(dict):
 
     def __getattr__(self, attr):
         """Special handling for accessing attributes,
-        If ``Block.attr`` does not exist, try to return Block[attr]. If that
-        does not exists either, return `attr` as a string, prefixed
-        by the name (and type) of the Block that is referenced.
-        This is for example necessary for referencing an attribute of a
-        Terraform resource which only becomes available after the resource
-        has been created.
+        If ``Block.attr`` does not exist, try to return Block[attr].
+        References to not yet existing attributes of resources, modules,
+        variables, locals and data sources are built by ``Item.__getattr__``
+        from the class level ``_attr_prefix``.
         Example:
            instance = terrascript.resources.aws_instance("server", ...)
            output = terrascript.Output("instance_ip_addr",
@@ -68,128 +100,273 @@ class Block(dict):
                                                     ^^^^^^^^^^
         Where ``instance.private_ip`` does not (yet) exist.
         """
-        # Try to return the entry in the dictionary. Otherwise return a string
-        # which must be formatted differently depending on what is referenced.
-
-        if attr in self:
+        try:
             return self[attr]
-        elif attr.startswith("__"):
-            raise AttributeError
-        else:
-            if isinstance(self, Resource):
-                return Attribute(f"{self.__class__.__name__}.{self._name}.{attr}")
-            if isinstance(self, Module):
-                return Attribute(f"module.{self._name}.{attr}")
-            if isinstance(self, Variable):
-                return Attribute(f"var.{self._name}.{attr}")
-            elif isinstance(self, Locals):
-                return Attribute(f"local.{attr}")
-            elif isinstance(self, Data):
-                # data.google_compute_image.NAME.ATTR
-                return Attribute(f"data.{self.__class__.__name__}.{self._name}.{attr}")
-            else:
-                raise AttributeError(attr)
+        except KeyError:
+            raise AttributeError(attr) from None
 
 
-def format_function(value):
-    lines = []
-    lines.append(value.args[0])
-    lines.append('(')
-    lines_inside = []
-    for arg in value.all_args[1:]:
-        if isinstance(arg, Function):
-            result = format_function(arg)
-        elif isinstance(arg, str):
-            result = str(arg)
-        elif isinstance(arg, dict):
-            result = format_dict(arg)
-        elif isinstance(arg, list):
-            result = format_list(arg)
-        elif isinstance(arg, Item):
-            result = arg.format()
-        lines_inside.append(result)
-
-    if isinstance(value, Function) and value.kwds:
-        lines_inside.append(format_dict(value.kwds))
-
-    fn_args = ', '.join(lines_inside)
-    return ''.join(lines) + fn_args + ')'
-
-
-def format_others(key: str, value: object, indent: int = 0):
-    temp_value = None
-    return_as_map = True
-
-    if any(isinstance(value, x) for x in [Connection, Backend]):
-        return_as_map = False
-        temp_value = value.format()
-    elif isinstance(value, Function):
-        temp_value = value.format()
-    elif isinstance(value, Item):
-        temp_value = value.format()
-    elif isinstance(value, dict):
-        temp_value = format_dict(value, indent=indent)
-    elif isinstance(value, list):
-        temp_value = format_list(value, indent=indent)
-    elif isinstance(value, Raw):
-        temp_value = value
-    elif isinstance(value, Quote):
-        temp_value = str(value)
-    # elif isinstance(value, str):
-    #     temp_value = f'"{value}"'
-    elif isinstance(value, bool):
-        temp_value = 'true' if value else 'false'
+def _write_text(buf: list, text: str, depth: int):
+    """Append `text`, indenting its continuation lines to `depth`.
+    Whitespace-only lines are left untouched, like ``textwrap.indent`` does.
+    """
+    if depth and "\n" in text:
+        newline = _NEWLINES[depth]
+        lines = text.split("\n")
+        if all(map(str.strip, lines)):
+            # Common case: no blank lines, indent everything in one join.
+            buf.append(newline.join(lines))
+            return
+        buf.append(lines[0])
+        for line in lines[1:]:
+            buf.append(newline + line if line.strip() else "\n" + line)
     else:
-        temp_value = value
+        buf.append(text)
+
+
+def _write_function(buf: list, value, depth: int):
+    all_args = value.all_args
+    append = buf.append
+    append(value.args[0] + "(")
+    separator = ""
+    for i in range(1, len(all_args)):
+        append(separator)
+        separator = ", "
+        nested = _write_value(buf, "", all_args[i], depth)
+        if nested is not None:
+            yield nested
+
+    if value.kwds:
+        append(separator)
+        nested = _write_dict(buf, value.kwds, depth)
+        if nested is not None:
+            yield nested
+    append(")")
+
+
+def _write_value(buf: list, key, value: object, depth: int):
+    """Append ``key = value`` to `buf`, or only the value when `key` is empty.
+    `depth` is the nesting level of the line the value starts on.
+    Scalars and flat containers are written right away and ``None`` is
+    returned; otherwise the generator writing the container is returned, to
+    be run by `_walk`.
+    """
+    cls = type(value)
+    if cls is str and "\n" not in value or cls is int:
+        # Most values are single-line strings and plain numbers.
+        buf.append(f"{key} = {value}" if key else str(value))
+        return None
+    writer = _WRITERS.get(cls) or _resolve_writer(cls)
+    if key and writer is not _write_block:
+        buf.append(f"{key} = ")
+    return writer(buf, value, depth)
+
+
+def _walk(writer):
+    """Run a container writer to completion.
+    Container writers either finish right away and return ``None`` or return
+    a generator that yields the writers of their nested containers; these are
+    run from an explicit stack rather than by recursion, so deeply nested
+    plans can not exhaust the call stack.
+    """
+    if writer is None:
+        return
+    stack = [writer]
+    while stack:
+        for nested in stack[-1]:
+            stack.append(nested)
+            break
+        else:
+            stack.pop()
 
-    if key and return_as_map:
-        return textwrap.indent(f'{key} = {temp_value}', '')
 
-    return textwrap.indent(f'{temp_value}', '')
+def _resolve_writer(cls: type):
+    """Find the writer of the closest registered base class of `cls` and
+    register it for `cls`, so the next lookup is a plain dict hit.
+    Items whose class overrides `format()` are written with that output.
+    """
+    for base in cls.__mro__:
+        if base in _WRITERS:
+            writer = _WRITERS[base]
+            if writer is not _write_block and issubclass(cls, Item) and cls.format is not base.format:
+                writer = _write_formatted
+            _WRITERS[cls] = writer
+            return writer
 
 
-def format_dict(dct: dict, indent: int = 0) -> str:
+def _write_scalar(buf: list, value: object, depth: int):
+    _write_text(buf, str(value), depth)
+
+
+def _write_quote(buf: list, value, depth: int):
+    _write_text(buf, f'"{value.value}"', depth)
+
+
+def _write_formatted(buf: list, item, depth: int):
+    _write_text(buf, item.format(), depth)
+
+
+def _write_bool(buf: list, value: bool, depth: int):
+    buf.append('true' if value else 'false')
+
+
+def _flat_body(dct: dict, newline: str):
+    """Return the ``key = value`` lines of `dct` when every value is a
+    single-line string or an int, the common case in Terraform blocks, which
+    needs no per-value dispatch. Return ``None`` otherwise.
+    """
     lines = []
-    lines.append("{")
     for k, v in dct.items():
-        v = format_others(k, v, indent=indent)
-        lines.append(textwrap.indent(f"{v}", IDENTATION))
-    lines.append("}")
-    return textwrap.indent("\n".join(lines), '')
+        cls = type(v)
+        if not k or cls not in _FLAT_TYPES or cls is not int and "\n" in v:
+            return None
+        lines.append(f"{newline}{k} = {v}")
+    return "".join(lines)
+
+
+def _write_dict(buf: list, dct: dict, depth: int):
+    newline = _NEWLINES[depth + 1]
+    body = _flat_body(dct, newline)
+    if body is not None:
+        buf.append("{" + body + _NEWLINES[depth] + "}")
+        return None
+    return _write_dict_entries(buf, dct, depth, newline)
+
+
+def _write_dict_entries(buf: list, dct: dict, depth: int, newline: str):
+    append = buf.append
+    append("{")
+    for k, v in dct.items():
+        append(newline)
+        nested = _write_value(buf, k, v, depth + 1)
+        if nested is not None:
+            yield nested
+    append(_NEWLINES[depth] + "}")
+
+
+def _write_list(buf: list, lst: list, depth: int):
+    if not lst:
+        buf.append("[\n" + _NEWLINES[depth] + "]")
+        return None
+    newline = _NEWLINES[depth + 1]
+    for v in lst:
+        cls = type(v)
+        if cls not in _FLAT_TYPES or cls is not int and ("\n" in v or not v or v.isspace()):
+            return _write_list_items(buf, lst, depth, newline)
+    # Only non-blank single-line strings and ints: no per-item dispatch needed.
+    separator = "," + newline
+    buf.append("[" + newline + separator.join(map(str, lst)) + _NEWLINES[depth] + "]")
+    return None
+
+
+def _write_list_items(buf: list, lst: list, depth: int, newline: str):
+    append = buf.append
+    append("[")
+    separator = newline
+    last = len(lst) - 1
+    for i, item in enumerate(lst):
+        if isinstance(item, str) and (not item or item.isspace()):
+            # Like textwrap.indent, leave a blank element unindented; the
+            # comma after it makes the line non-blank at the outer level.
+            append(("," if i else "") + (_NEWLINES[depth] if i < last else "\n") + item)
+            separator = "," + newline
+            continue
+        append(separator)
+        separator = "," + newline
+        nested = _write_value(buf, "", item, depth + 1)
+        if nested is not None:
+            yield nested
+    append(_NEWLINES[depth] + "]")
+
+
+def _write_item(buf: list, item, depth: int):
+    newline = _NEWLINES[depth + 1]
+    body = None if item.items else _flat_body(item.kwds, newline)
+    if body is not None:
+        buf.append(item._header + body + _NEWLINES[depth] + "}")
+        return None
+    return _write_item_body(buf, item, depth, newline)
+
+
+def _write_item_body(buf: list, item, depth: int, newline: str):
+    append = buf.append
+    append(item._header)
+    for nested in item.items:
+        append(newline)
+        nested = _write_value(buf, "", nested, depth + 1)
+        if nested is not None:
+            yield nested
+
+    for k, v in item.kwds.items():
+        append(newline)
+        nested = _write_value(buf, k, v, depth + 1)
+        if nested is not None:
+            yield nested
+    append(_NEWLINES[depth] + "}")
+
+
+def _write_block(buf: list, item, depth: int):
+    """Write a nested block such as ``connection { ... }``, which has no key."""
+    if type(item).format is not Item.format:
+        _write_formatted(buf, item, depth)
+        return None
+    return _write_item(buf, item, depth)
+
+
+def format_function(value) -> str:
+    buf = []
+    _walk(_write_function(buf, value, 0))
+    return "".join(buf)
+
+
+def format_others(key: str, value: object, indent: int = 0) -> str:
+    buf = []
+    _walk(_write_value(buf, key, value, indent))
+    return "".join(buf)
+
+
+def format_dict(dct: dict, indent: int = 0) -> str:
+    buf = []
+    _walk(_write_dict(buf, dct, indent))
+    return "".join(buf)
 
 
 def format_list(lst: list, indent: int = 0) -> str:
-    lines = []
-    lines.append("[")
-    inside_lines = []
-    for item in lst:
-        item = format_others('', item, indent=indent)
-        inside_lines.append(textwrap.indent(f"{item}", IDENTATION))
-    lines.append(',\n'.join(inside_lines))
-    lines.append("]")
-    return textwrap.indent("\n".join(lines), '')
+    buf = []
+    _walk(_write_list(buf, lst, indent))
+    return "".join(buf)
 
 
 class Item:
+    __slots__ = ('_type', 'args', 'all_args', 'kwds', 'items', '_header', '_refs')
+
+    # Prefix of the references built by `__getattr__`, ``None`` when the
+    # item can not be referenced.
+    _attr_prefix = None
 
     def __init__(self, item_type: str, *args, **kwds):
-        self.type = item_type
-        self.args = tuple(arg for arg in args if not isinstance(arg, Item))
-        self.all_args = tuple(arg for arg in args)
-        self.kwds = Block(**kwds)
-        self.items = tuple(item for item in args if isinstance(item, Item))
+        plain_args = []
+        items = []
+        for arg in args:
+            (items if isinstance(arg, Item) else plain_args).append(arg)
+
+        self._type = item_type
+        self.args = tuple(plain_args)
+        self.all_args = args
+        self.kwds = Block(kwds)
+        self.items = tuple(items)
+        self._header = item_type + "".join([f' "{arg}"' for arg in plain_args]) + " {"
+        self._refs = None
 
-    def format(self) -> str:
-        lines = []
+    @property
+    def type(self) -> str:
+        # `BaseItem` subclasses shadow this with a class attribute.
+        return self._type
 
-        lines.append(self.type + "".join(' "{}"'.format(arg) for arg in self.args) + " {")
-        for item in self.items:
-            lines.append(textwrap.indent(item.format(), IDENTATION))
-        for k, v in self.kwds.items():
-            v = format_others(k, v)
-            lines.append(textwrap.indent(f'{v}', IDENTATION))
-        lines.append("}")
-        return "\n".join(lines)
+    def format(self) -> str:
+        buf = []
+        _walk(_write_item(buf, self, 0))
+        return "".join(buf)
 
     def __getattr__(self, attr):
         """Special handling for accessing attributes,
@@ -209,32 +386,37 @@ class Item:
         # Try to return the entry in the dictionary. Otherwise return a string
         # which must be formatted differently depending on what is referenced.
 
-        if attr in self.kwds:
+        # Dunder lookups come first: copy and pickle probe them before the
+        # slots are filled in, when `kwds` can not be read yet.
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        elif attr in self.kwds:
             return self.kwds[attr]
-        elif attr.startswith("__"):
-            raise AttributeError
-        else:
-            if isinstance(self, Resource):
-                resource_name = self.args[0]
-                return Attribute(f"{resource_name}.{attr}")
-            if isinstance(self, Module):
-                return Attribute(f"module.{attr}")
-            if isinstance(self, Variable):
-                return Attribute(f"var.{attr}")
-            elif isinstance(self, Locals):
-                return Attribute(f"local.{attr}")
-            elif isinstance(self, Data):
-                # data.google_compute_image.NAME.ATTR
-                return Attribute(f"data.{self.__class__.__name__}.{attr}")
-            else:
-                raise AttributeError(attr)
+
+        refs = self._refs
+        if refs is None:
+            refs = self._refs = {}
+        elif attr in refs:
+            return refs[attr]
+
+        prefix = self._attr_prefix
+        if prefix is None:
+            raise AttributeError(attr)
+        ref = refs[attr] = _attribute(prefix + attr)
+        return ref
 
     def __str__(self):
-        class_name = self.__class__.__name__
-        return Attribute('{0}.{1}'.format(class_name, class_name))
+        # Only depends on the class, so build it once per class.
+        cls = type(self)
+        ref = cls.__dict__.get("_str_ref")
+        if ref is None:
+            class_name = cls.__name__
+            ref = cls._str_ref = Attribute('{0}.{1}'.format(class_name, class_name))
+        return ref
 
 
 class BaseItem(Item):
+    __slots__ = ()
     type = ''
 
     def __init__(self, *args, **kwds):
@@ -242,33 +424,46 @@ class BaseItem(Item):
 
 
 class Provider(BaseItem):
+    __slots__ = ()
     type = 'provider'
 
 
 class Resource(BaseItem):
+    __slots__ = ()
     type = 'resource'
 
+    @property
+    def _attr_prefix(self):
+        return f"{self.args[0]}."
+
     def asterisk(self):
         pass
 
 
 class Output(BaseItem):
+    __slots__ = ()
     type = 'output'
 
 
 class Locals(BaseItem):
+    __slots__ = ()
     type = 'locals'
+    _attr_prefix = 'local.'
 
 
 class Module(BaseItem):
+    __slots__ = ()
     type = 'module'
+    _attr_prefix = 'module.'
 
 
 class Provisioner(BaseItem):
+    __slots__ = ()
     type = 'provisioner'
 
 
 class Function(BaseItem):
+    __slots__ = ()
     type = 'function'
 
     def format(self):
@@ -276,26 +471,40 @@ class Function(BaseItem):
 
 
 class Variable(BaseItem):
+    __slots__ = ()
     type = 'variable'
+    _attr_prefix = 'var.'
 
 
 class Connection(BaseItem):
     """docs: https://www.terraform.io/docs/language/resources/provisioners/connection.html"""
+    __slots__ = ()
     type = 'connection'
 
 
 class Backend(BaseItem):
+    __slots__ = ()
     type = 'backend'
 
 
 class Data(BaseItem):
+    __slots__ = ()
     type = 'data'
 
+    @property
+    def _attr_prefix(self):
+        # data.google_compute_image.NAME.ATTR
+        return f"data.{self.__class__.__name__}."
+
 
 class Terraform(BaseItem):
+    __slots__ = ()
     type = 'terraform'
 
 
+# Plans tend to build the same literal blocks over and over again, and
+# dedenting has to scan the whole text each time.
+@functools.lru_cache(maxsize=1024)
 def TFBlock(value, indent: int = 0):
     formatted = textwrap.dedent(value)
     if value.startswith('\n'):
@@ -306,12 +515,15 @@ def TFBlock(value, indent: int = 0):
 class FunctionGenerator:
 
     def __getattr__(self, name):
-        def func(*args, **kwargs):
-            return Function(name, *args, **kwargs)
+        # Only called on a miss: the factory is stored on the instance, so
+        # later lookups of the same function name are plain attribute hits.
+        func = functools.partial(Function, name)
+        setattr(self, name, func)
         return func
 
 
 class Raw:
+    __slots__ = ('value',)
 
     def __init__(self, value):
         self.value = value
@@ -334,6 +546,7 @@ class Raw:
 
 
 class Quote:
+    __slots__ = ('value',)
 
     def __init__(self, value):
         self.value = value
@@ -345,7 +558,31 @@ class Quote:
         return str(self)
 
 
+# Value types `_flat_body` writes verbatim.
+_FLAT_TYPES = frozenset((str, Attribute, int))
+
+# Writers used by `_write_value`, looked up by the exact type of the value.
+# Other types are resolved through their MRO by `_resolve_writer` and
+# added here on first use.
+_WRITERS = {
+    Connection: _write_block,
+    Backend: _write_block,
+    Function: _write_function,
+    Item: _write_item,
+    dict: _write_dict,
+    list: _write_list,
+    bool: _write_bool,
+    str: _write_text,
+    int: _write_scalar,
+    float: _write_scalar,
+    Raw: _write_scalar,
+    Quote: _write_quote,
+    object: _write_scalar,
+}
+
+
 class Plan:
+    __slots__ = ('kwds',)
 
     def __init__(self):
         # self.items = []
@@ -375,6 +612,20 @@ class Plan:
             self.kwds[item.type].append(item)
         return self
 
+    def update(self, plan: "Plan"):
+        """Merge the items of `plan` into this plan."""
+        if not isinstance(plan, Plan):
+            raise ValueError
+
+        for item_type, bucket in plan.kwds.items():
+            current = self.kwds.get(item_type)
+            if current is None:
+                self.kwds[item_type] = Block(bucket) if isinstance(bucket, dict) else list(bucket)
+            elif isinstance(bucket, dict):
+                current.update(bucket)
+            else:
+                current.extend(bucket)
+
     @property
     def items(self):
         """
@@ -393,31 +644,35 @@ class Plan:
 
         return _items
 
-    # fmt: off
+    def _partition(self):
+        """Split the items into body, variables and outputs in one walk."""
+        body, variables, outputs = [], [], []
+        for item_type, bucket in self.kwds.items():
+            if item_type == "variable":
+                target = variables
+            elif item_type == "output":
+                target = outputs
+            else:
+                target = body
+            target.extend(bucket.values() if isinstance(bucket, dict) else bucket)
+        return body, variables, outputs
+
+    @staticmethod
+    def _format_items(items) -> str:
+        return "\n\n".join([item.format() for item in items]).strip("\n")
+
     def format(self):
-        return "\n\n".join(
-            map(
-                lambda item: item.format(),
-                filter(lambda item: item.type not in ("variable", "output"), self.items),
-            )
-        ).strip("\n")
+        return self._format_items(self._partition()[0])
 
     def format_vars(self):
-        return "\n\n".join(
-            map(
-                lambda item: item.format(),
-                filter(lambda item: item.type == "variable", self.items))
-        ).strip("\n")
+        return self._format_items(self._partition()[1])
 
     def format_outs(self):
-        return "\n\n".join(
-            map(
-                lambda item: item.format(),
-                filter(lambda item: item.type == "output", self.items))
-        ).strip("\n")
-    # fmt: on
+        return self._format_items(self._partition()[2])
 
     def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
         list_obj = self.kwds.get(name, Block())
         return list_obj
         return Attribute(f'{self}.{name}')
@@ -435,30 +690,50 @@ def clear_dir(odir: str):
         logging.info("Aborted by user")
         sys.exit(-1)
 
+    # Generated files start with the header line, see write().
+    header = (HEADER + "\n").encode()
+
     def clear(odir):
-        for filename in filter(lambda item: item.endswith(".tf") or item.endswith(".tfvar"), os.listdir(odir)):
-            with open(filename, "r") as f:
-                if f.readline() != HEADER:
+        with os.scandir(odir) as it:
+            entries = list(it)
+
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith((".tf", ".tfvars")):
+                fd = os.open(entry.path, os.O_RDONLY)
+                try:
+                    head = os.read(fd, len(header))
+                finally:
+                    os.close(fd)
+                if head != header:
                     continue
-            os.remove(filename)
+                os.remove(entry.path)
 
-        for dirname in [item for item in os.listdir(odir) if os.path.isdir(item)]:
-            if not os.listdir(dirname):
-                os.rmdir(dirname)
-            else:
-                clear(dirname)
-                if not os.listdir(dirname):
-                    os.rmdir(dirname)
+        for entry in entries:
+            if entry.is_dir():
+                clear(entry.path)
+                try:
+                    os.rmdir(entry.path)
+                except OSError:
+                    # Not empty: it still holds files we did not generate.
+                    pass
 
     clear(odir)
 
 
-def load_main_module(moddir: str):
+def load_main_module(moddir: str, _modules: dict = None):
+    # `_modules` maps the real path of every module directory loaded so far
+    # in this run to its module, so a shared module is only executed once.
+    if _modules is None:
+        _modules = {}
+    key = os.path.realpath(moddir)
+    if key in _modules:
+        return _modules[key]
+
     curdir = os.path.abspath(os.path.curdir)
 
     try:
         os.chdir(moddir)
-        if moddir not in set(sys.path):
+        if moddir not in sys.path:
             sys.path.append(moddir)
 
         modpath = os.path.join(moddir, "main.py")
@@ -475,79 +750,91 @@ def load_main_module(moddir: str):
         #     logging.error(f"Valid plan object not found in module {modpath}")
         #     sys.exit(-1)
 
+        _modules[key] = module
         return module
 
     finally:
         os.chdir(curdir)
 
 
-def write(odir: str, module: object):
-    def write_file(content, file_name):
-        file_path = os.path.join(odir, file_name)
-        with open(file_path, "w") as f:
-            f.write("\n\n".join((HEADER, content)))
-
+def write(odir: str, module: object, _modules: dict = None, _written: set = None):
+    if _modules is None:
+        _modules = {}
+    if _written is None:
+        _written = set()
+    _written.add(os.path.realpath(odir))
     os.makedirs(odir, exist_ok=True)
 
-    body = module.plan.format()
-    if body:
-        write_file(body, "main.tf")
-
-    variables = module.plan.format_vars()
-    if variables:
-        write_file(variables, "variables.tf")
-
-    outputs = module.plan.format_outs()
-    if outputs:
-        write_file(outputs, "outputs.tf")
+    # One walk over the plan for all three files.
+    body, variables, outputs = module.plan._partition()
+    files = (
+        ("main.tf", Plan._format_items(body)),
+        ("variables.tf", Plan._format_items(variables)),
+        ("outputs.tf", Plan._format_items(outputs)),
+    )
+    for file_name, content in files:
+        if not content:
+            continue
+        # Encode once and write in binary mode: skips the text layer and
+        # keeps the output UTF-8 whatever the locale is.
+        with open(os.path.join(odir, file_name), "wb") as f:
+            f.write(HEADER.encode())
+            f.write(b"\n\n")
+            f.write(content.encode())
 
     for item in module.plan.modules:
         source = item.kwds.get("source", "").strip('"')
-        if source and (source.startswith(".") or source.startswith("..")):
-            module = load_main_module(os.path.abspath(source))
+        if source.startswith("."):
             moddir = os.path.join(odir, source)
+            if os.path.realpath(moddir) in _written:
+                # Shared submodule, already written for another reference.
+                continue
+            module = load_main_module(os.path.abspath(source), _modules)
             curdir = os.path.abspath(os.path.curdir)
             try:
                 os.chdir(os.path.join(curdir, source))
-                write(moddir, module)
+                write(moddir, module, _modules, _written)
             finally:
                 os.chdir(curdir)
 
 
-def generate(idir: str, odir: str):
+def generate(idir: str, odir: str, fmt: bool = True):
     # if os.path.exists(odir):
     #     clear_dir(odir)
 
     os.chdir(idir)
 
-    module = load_main_module(idir)
-    write(odir, module)
+    modules = {}
+    module = load_main_module(idir, modules)
+    write(odir, module, modules)
+
+    if not fmt:
+        return
 
     try:
-        subprocess.run(["terraform", "fmt"], cwd=odir, check=True)
+        subprocess.run(["terraform", "fmt", "-recursive"], cwd=odir, check=True)
     except subprocess.CalledProcessError as e:
         logging.error(e)
         sys.exit(-1)
 
 
-def upgrade(odir: str):
-    items = os.listdir(odir)
+def _upgrade_dir(odir: str):
+    subprocess.run(["terraform", "0.13upgrade", "-yes"], cwd=odir, check=True)
 
-    if any(filter(lambda item: item.endswith(".tf"), items)):
-        try:
-            subprocess.run(["terraform", "0.13upgrade", "-yes"], cwd=odir, check=True)
-        except subprocess.CalledProcessError as e:
-            logging.error(e)
-            sys.exit(-1)
 
-    for item in items:
-        item = os.path.join(odir, item)
-        if os.path.isdir(item):
-            upgrade(item)
+def upgrade(odir: str):
+    dirs = [root for root, _, files in os.walk(odir) if any(name.endswith(".tf") for name in files)]
+
+    try:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(_upgrade_dir, dirs))
+    except subprocess.CalledProcessError as e:
+        logging.error(e)
+        sys.exit(-1)
 
 
 def generate_cmd(args):
-    generate(args.idir, args.idir)
+    generate(args.idir, args.idir, fmt=args.fmt)
     if args.upgrade:
         upgrade(args.idir)
 
@@ -565,6 +852,13 @@ def main():
     parser_generate_cmd.add_argument(
         "-u", "--upgrade", action="store_true", help="run 'terraform 0.13upgrade' command for each module"
     )
+    parser_generate_cmd.add_argument(
+        "--fmt", dest="fmt", action="store_true", default=True,
+        help="run 'terraform fmt' on the generated files (default)"
+    )
+    parser_generate_cmd.add_argument(
+        "--no-fmt", dest="fmt", action="store_false", help="skip running 'terraform fmt'"
+    )
     parser_generate_cmd.add_argument(
         "idir",
         metavar="DIR",
@@ -1,5 +1,4 @@
 import pytfe
-import textwrap
 
 
 from pytfe import Raw
@@ -73,7 +72,7 @@ class TestFunctionGenerator(TestCase):
     def test_simple(self):
         func = pytfe.f.list()
 
-        expected = textwrap.dedent("""list()""")
+        expected = "list()"
         self.assertEqual(func.format(), expected)
 
     def test_simple_two_nested_function(self):
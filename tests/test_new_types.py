@@ -1,4 +1,6 @@
-import textwrap
+import pickle
+import pytest
+import sys
 import pytfe
 
 from pytfe import Item
@@ -59,6 +61,31 @@ def test_item():
     }""")
 
 
+def test_format_nested_function_item():
+    resource = pytfe.Resource("a", "b", pytfe.Function("f", "x"))
+    assert resource.format() == 'resource "a" "b" {\n  f(x)\n}'
+
+
+def test_format_item_value_with_custom_format():
+    class Custom(Item):
+        def format(self):
+            return "custom()"
+
+    resource = pytfe.Resource("a", "b", v=Custom("c"))
+    assert resource.format() == 'resource "a" "b" {\n  v = custom()\n}'
+
+
+def test_format_list_with_blank_elements():
+    assert pytfe.format_list([""]) == "[\n\n]"
+    assert pytfe.format_list(["", "a"], indent=0) == "[\n,\n  a\n]"
+
+
+def test_format_helpers_accept_indent():
+    assert pytfe.format_dict({"a": "1"}, indent=0) == "{\n  a = 1\n}"
+    assert pytfe.format_list(["1"], indent=0) == "[\n  1\n]"
+    assert pytfe.format_others("a", "1", indent=0) == "a = 1"
+
+
 def test_plan():
     plan = Plan()
     assert plan.items == []
@@ -96,3 +123,101 @@ def test_plan():
     module "module_a" {
       source = "./module_a"
     }""")
+
+
+def test_plan_update():
+    plan = Plan()
+    plan.update(Plan())
+    assert plan.items == []
+    assert plan.format() == ""
+
+    other = Plan()
+    variable = Item("variable", "image", type="string")
+    provider = Item("provider", "docker")
+    other += variable
+    plan.update(other)
+    assert plan.items == [variable]
+    assert plan.format_vars() == pytfe.TFBlock("""
+    variable "image" {
+      type = string
+    }""")
+
+    other += provider
+    plan.update(other)
+    assert plan.items == [variable, provider]
+
+    locals_ = Item("locals", name='"foo"')
+    plan += locals_
+    other = Plan()
+    other += Item("locals", image='"redis"')
+    plan.update(other)
+    assert plan.kwds["locals"] == [locals_, other.kwds["locals"][0]]
+    assert len(other.kwds["locals"]) == 1
+
+
+def test_item_references():
+    assert pytfe.Resource("docker_container", "foo").id == "docker_container.id"
+    assert pytfe.Module("consul").address == "module.address"
+    assert pytfe.Variable("image").image == "var.image"
+    assert pytfe.Locals().service_name == "local.service_name"
+    assert pytfe.Provider("docker", host='"tcp://host"').host == '"tcp://host"'
+    with pytest.raises(AttributeError):
+        pytfe.Provider("docker").host
+
+
+def test_load_main_module_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    (tmp_path / "main.py").write_text("import pytfe\nplan = pytfe.Plan()\n")
+
+    modules = {}
+    module = pytfe.app.load_main_module(str(tmp_path), modules)
+    assert isinstance(module.plan, Plan)
+    assert pytfe.app.load_main_module(str(tmp_path), modules) is module
+    assert pytfe.app.load_main_module(str(tmp_path)) is not module
+
+
+def test_format_deeply_nested_values():
+    depth = 2 * sys.getrecursionlimit()
+    value = "leaf"
+    for _ in range(depth):
+        value = {"k": [value]}
+
+    text = Item("locals", deep=value).format()
+    assert text.count("{") == depth + 1
+    assert text.endswith("\n}")
+
+
+def test_attribute_references_are_shared():
+    resource = pytfe.Resource("aws_instance", "web")
+    assert resource.private_ip is resource.private_ip
+    assert resource.network.id is resource.network.id
+    assert resource.network.id == "aws_instance.network.id"
+
+
+def test_clear_dir_removes_generated_files(tmp_path, monkeypatch):
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    for path in (tmp_path / "main.tf", tmp_path / "terraform.tfvars", sub / "outputs.tf"):
+        path.write_text(pytfe.app.HEADER + "\n\nlocals {\n}")
+    (tmp_path / "manual.tf").write_text("locals {\n}")
+
+    monkeypatch.setattr("builtins.input", lambda prompt: "y")
+    pytfe.app.clear_dir(str(tmp_path))
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["manual.tf"]
+
+
+def test_function_generator_reuses_factories():
+    f = pytfe.app.FunctionGenerator()
+    assert f.jsonencode is f.jsonencode
+    assert f.jsonencode("local.tags").format() == "jsonencode(local.tags)"
+
+
+def test_plan_can_be_pickled():
+    plan = Plan()
+    plan += pytfe.Variable("region", default='"eu-west-1"')
+    plan += pytfe.Resource("aws_instance", "web", ami='"ami-123"', count=2)
+
+    restored = pickle.loads(pickle.dumps(plan))
+    assert restored.format() == plan.format()
+    assert restored.format_vars() == plan.format_vars()